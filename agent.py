@@ -1,6 +1,5 @@
-from .utils.utils import save_detections_video, get_object_intervals, tic, toc, extract_timeframe, CustomException, get_video_duration, trim_video
-from .utils.llm import VLLM, LLM, remove_files, flush_files
-import google.generativeai as genai
+from .utils.utils import save_detections_video, get_object_intervals, get_label_intervals, tic, toc, extract_timeframe, CustomException, get_video_duration, trim_video, Deadline
+from .utils.llm import VLLM, LLM, remove_files, flush_files, configure
 from .utils.logger import Logger
 import re
 import os
@@ -247,14 +246,16 @@ LLM_CALL_3_NOQA = """\
 
 
 class ViQAgent():
-    def __init__(self, model_name, api_key, dataset_subinstruction="", log_config={}, yolo_params={}, llm_params={}):
+    def __init__(self, model_name, api_key, dataset_subinstruction="", log_config={}, yolo_params={}, llm_params={}, detector=None, search_stride=None):
         self.log = (
             log_config if isinstance(log_config, Logger) else Logger(**log_config)
         ).log
-        genai.configure(api_key=api_key)
-        try: from .utils.yolo import YOLO
-        except: raise ImportError("YOLO-World requires GPU, but no GPU was found")
-        self.yolo = YOLO("yolo_world/l", **yolo_params)
+        configure(api_key)
+        if search_stride and detector is not None and not hasattr(detector, 'search_video'):
+            raise ValueError(f"search_stride requires a detector with `search_video`, which {type(detector).__name__} doesn't have")
+        self.detector = detector # e.g. a `YOLOClient` of a shared `YOLOServer`
+        self.yolo_params = yolo_params
+        self.search_stride = search_stride # coarse-to-fine grounding, see `YOLO.search_video`
         self.videollm1 = VLLM(model_name, VLLM_PROMPT_1+dataset_subinstruction, VLLM_SCHEMA_1, log=self.log, **llm_params)
         self.videollm2 = VLLM(model_name, VLLM_PROMPT_2, VLLM_SCHEMA_2, log=self.log, **llm_params)
         self.videollm3 = VLLM(model_name, VLLM_PROMPT_3, VLLM_SCHEMA_3, log=self.log, **llm_params)
@@ -263,11 +264,39 @@ class ViQAgent():
         self.llm2 = LLM(model_name, LLM_PROMPT_2, LLM_SCHEMA_2, log=self.log, **llm_params)
         self.llm3 = LLM(model_name, LLM_PROMPT_3+dataset_subinstruction, LLM_SCHEMA_3, log=self.log, **llm_params)
 
+    @property
+    def yolo(self):
+        # YOLO-World (and its dependencies) are only imported on first use, or by `warmup`
+        if self.detector is None:
+            try: from .utils.yolo import YOLO
+            except: raise ImportError("YOLO-World requires GPU, but no GPU was found")
+            self.detector = YOLO("yolo_world/l", **self.yolo_params)
+        return self.detector
+
+    def warmup(self, classes=["person"]):
+        """
+        Preload what is otherwise loaded on the first question: the Gemini client and models,
+        and the detector (model, embeddings of `classes` and a dummy inference).
+        """
+        for llm in [self.videollm1, self.videollm2, self.videollm3, self.videollm4, self.llm1, self.llm2, self.llm3]:
+            llm.model
+        if hasattr(self.yolo, 'warmup'):
+            self.yolo.warmup(classes)
+
+    def close(self):
+        # stops the detector's worker processes (long-video mode) or releases its server queue
+        if self.detector is not None and hasattr(self.detector, 'close'):
+            self.detector.close()
+
     def rm_cache(self):
         remove_files(self.videollm1.last_execution_files)
         self.log(f"Removed from cache {len(self.videollm1.last_execution_files)} files")
 
-    def invoke(self, video, query, answer_options=[]):
+    def invoke(self, video, query, answer_options=[], flush=True, deadline=None):
+        """
+        `deadline` is an optional time budget (s) for the whole invocation. If it runs out after
+        VLLM1 has answered, the VLLM1 answer is returned as the final answer.
+        """
         opts_str = "\n".join([f"{i}. {v}" for i,v in enumerate(answer_options)])
         if opts_str:
             prompt = f"- **Question**: {query}\n- **Possible answers**:\n{opts_str}"
@@ -281,36 +310,45 @@ class ViQAgent():
             'video_duration': get_video_duration(video),
         }
 
-        flush_files()
-
-        self.m1(video, prompt, responses, usages, delays)
-        self.og(video, responses, delays)
-        self.m2(video, prompt, responses, usages, delays)
+        # with flush=False the uploaded video is reused by the next questions on it (see `rm_cache`)
+        if flush: flush_files()
+
+        self.last_invocation = { 'responses': responses, 'usages': usages, 'delays': delays }
+        deadline = Deadline(deadline)
+        try:
+            self.m1(video, prompt, responses, usages, delays, deadline)
+            self.og(video, responses, delays, deadline)
+            self.m2(video, prompt, responses, usages, delays, deadline)
+        except TimeoutError as e:
+            if 'vllm1' not in responses: raise e
+            self.log(f"{e}, falling back to the VLLM1 answer\n")
+            responses['metadata']['degraded'] = True
+            responses['llm3'] = responses['vllm1']
 
         return responses['vllm1']['answer'], responses['llm3']['answer']
     
-    def m1(self, video, prompt, responses, usages, delays):
+    def m1(self, video, prompt, responses, usages, delays, deadline=None):
         #self.log(f"VLLM Prompt:\n{prompt}")
 
         tic()
-        r1, usages['vllm1'] = self.videollm1(video, prompt)
+        r1, usages['vllm1'] = self.videollm1(video, prompt, deadline=deadline)
         responses['vllm1'] = r1
         delays['vllm1'] = toc()
         self.log(f"VLLM1 response:\n{r1}\n")
 
         tic()
-        r2, usages['vllm2'] = self.videollm2(video, prompt)
+        r2, usages['vllm2'] = self.videollm2(video, prompt, deadline=deadline)
         responses['vllm2'] = r2
         delays['vllm2'] = toc()
         self.log(f"VLLM2 response:\n{r2}\n")
 
         tic()
-        r3, usages['vllm3'] = self.videollm3(video, prompt)
+        r3, usages['vllm3'] = self.videollm3(video, prompt, deadline=deadline)
         responses['vllm3'] = r3
         delays['vllm3'] = toc()
         self.log(f"VLLM3 response:\n{r3}\n")
 
-    def m1_qa(self, video, questions, responses, usages, delays, trim=False):
+    def m1_qa(self, video, questions, responses, usages, delays, trim=False, deadline=None):
         answers = []
         for i, _q in enumerate(questions):
             i += 1
@@ -326,13 +364,13 @@ class ViQAgent():
 
                 try:
 
-                    r, tk = self.videollm4(_video, _q)
+                    r, tk = self.videollm4(_video, _q, deadline=deadline)
                     if timeframe: os.remove(_video)
                 except Exception as e: 
                     if timeframe: os.remove(_video)
                     raise e
             else:
-                r, tk = self.videollm4(video, _q)
+                r, tk = self.videollm4(video, _q, deadline=deadline)
 
             usages[f'vllm4_{i}'] = tk
             responses[f'vllm4_{i}'] = r
@@ -343,18 +381,26 @@ class ViQAgent():
 
         return answers
 
-    def og(self, video, responses, delays):
+    def og(self, video, responses, delays, deadline=None):
         classes = responses['vllm3']['targets']         # T
+        if deadline is not None and deadline.expired():
+            raise TimeoutError("Deadline exceeded before object grounding")
 
         tic()
-        detections = self.yolo.process_video(classes, video)
-        save_detections_video(detections, video, f"{video[:-4]}_yolo.{video[-3:]}")
-        object_intervals = get_object_intervals(classes, detections, video)
+        if self.search_stride:
+            labels = self.yolo.search_video(classes, video, stride=self.search_stride, deadline=deadline)
+            object_intervals = get_label_intervals(classes, labels, video)
+        else:
+            detections = self.yolo.process_video(classes, video, deadline=deadline)
+            save_detections_video(detections, video, f"{video[:-4]}_yolo.{video[-3:]}")
+            object_intervals = get_object_intervals(classes, detections, video)
+            stage_stats = getattr(self.yolo, 'stage_stats', None)
+            if stage_stats: self.log(f"YOLO stage utilization: {stage_stats}")
         responses['yw'] = object_intervals
         delays['yw'] = toc()
         self.log(f"YOLO detections:\n{object_intervals}\n")
 
-    def m2(self, video, prompt, responses, usages, delays):
+    def m2(self, video, prompt, responses, usages, delays, deadline=None):
         video_duration = responses['metadata']['video_duration']
         reasoning1 = responses['vllm1']['reasoning']    # R1
         captions = responses['vllm2']['timeframes']     # TC
@@ -368,7 +414,7 @@ class ViQAgent():
         llm1_prompt = LLM_CALL_1.format(reasoning1=reasoning1, captions=captions, yolo_grounding=yolo_grounding)
         #self.log(f"LLM1 prompt:\n{llm1_prompt}\n")
         tic()
-        r1, usages['llm1'] = self.llm1(llm1_prompt)
+        r1, usages['llm1'] = self.llm1(llm1_prompt, deadline=deadline)
         responses['llm1'] = r1
         delays['llm1'] = toc()
         self.log(f"LLM1 response:\n{r1}\n")
@@ -380,25 +426,25 @@ class ViQAgent():
             llm2_prompt = LLM_CALL_2.format(prompt=prompt, discrepancies=discrepancies, video_duration=video_duration)
             #self.log(f"LLM2 prompt:\n{llm2_prompt}\n")
             tic()
-            r2, usages['llm2'] = self.llm2(llm2_prompt)
+            r2, usages['llm2'] = self.llm2(llm2_prompt, deadline=deadline)
             responses['llm2'] = r2
             delays['llm2'] = toc()
             self.log(f"LLM2 response:\n{r2}\n")
 
             questions = r2['questions']
-            answers = self.m1_qa(video, questions, responses, usages, delays)
+            answers = self.m1_qa(video, questions, responses, usages, delays, deadline=deadline)
             qa_str = "\n".join([f"- {q} - {a}" for i,(q,a) in enumerate(list(zip(questions, answers)))])
 
             llm3_prompt = LLM_CALL_3.format(prompt=prompt, reasoning1=reasoning1, captions=captions, yolo_grounding=yolo_grounding, qa_str=qa_str)
             #self.log(f"LLM3 prompt:\n{llm3_prompt}\n")
             tic()
-            responses['llm3'], usages['llm3'] = self.llm3(llm3_prompt)
+            responses['llm3'], usages['llm3'] = self.llm3(llm3_prompt, deadline=deadline)
             delays['llm3'] = toc()
             self.log(f"LLM3 response:\n{responses['llm3']}\n")
         else:
             llm3_prompt = LLM_CALL_3_NOQA.format(prompt=prompt, reasoning1=reasoning1, captions=captions, yolo_grounding=yolo_grounding)
             #self.log(f"LLM3 prompt:\n{llm3_prompt}\n")
             tic()
-            responses['llm3'], usages['llm3'] = self.llm3(llm3_prompt)
+            responses['llm3'], usages['llm3'] = self.llm3(llm3_prompt, deadline=deadline)
             delays['llm3'] = toc()
             self.log(f"LLM3 response:\n{responses['llm3']}\n")
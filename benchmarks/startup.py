@@ -0,0 +1,49 @@
+"""
+Measure the cold-start of a worker: importing the agent, constructing `ViQAgent` and
+`ViQAgent.warmup`, each run in a fresh interpreter so nothing is cached between runs.
+
+    python -m ViQAgent.benchmarks.startup --runs 5
+"""
+from statistics import median
+import subprocess
+import argparse
+import json
+import sys
+import os
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP_SCRIPT = """
+import json, time, os
+t0 = time.perf_counter()
+from {package}.agent import ViQAgent
+t1 = time.perf_counter()
+agent = ViQAgent({model!r}, os.environ.get("GOOGLE_API_KEY", ""), log_config={{'verbose': 'silent'}})
+t2 = time.perf_counter()
+if {warmup}: agent.warmup()
+t3 = time.perf_counter()
+print(json.dumps({{'import': t1 - t0, 'construct': t2 - t1, 'warmup': t3 - t2, 'total': t3 - t0}}))
+"""
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--model", default="gemini-1.5-flash")
+    parser.add_argument("--no-warmup", action="store_true")
+    args = parser.parse_args()
+
+    script = STARTUP_SCRIPT.format(package=os.path.basename(PACKAGE_DIR), model=args.model, warmup=not args.no_warmup)
+    runs = []
+    for _ in range(args.runs):
+        out = subprocess.run(
+            [sys.executable, "-c", script], cwd=os.path.dirname(PACKAGE_DIR),
+            capture_output=True, text=True, check=True
+        ).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+
+    for stage in runs[0]:
+        times = [run[stage] for run in runs]
+        print(f"{stage:>9}: median {median(times):.3f}s (min {min(times):.3f}s, max {max(times):.3f}s)")
+
+if __name__ == "__main__":
+    main()
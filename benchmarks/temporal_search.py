@@ -0,0 +1,49 @@
+"""
+Compare the coarse-to-fine `YOLO.search_video` against the full `YOLO.process_video` scan:
+detector calls, wall time, and agreement of the per-frame labels and of the final intervals.
+
+    python -m ViQAgent.benchmarks.temporal_search video.mp4 "person" "dog" --stride 30
+"""
+from ..utils.utils import frame_label, get_label_intervals
+from ..utils.yolo import YOLO
+import argparse
+import time
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("video")
+    parser.add_argument("classes", nargs="+")
+    parser.add_argument("--stride", type=int, nargs="+", default=[8, 15, 30, 60])
+    parser.add_argument("--precision-ms", type=float, default=None)
+    parser.add_argument("--merge-threshold-ms", type=float, default=1500)
+    args = parser.parse_args()
+
+    yolo = YOLO()
+
+    start = time.time()
+    detections = yolo.process_video(args.classes, args.video)
+    full_time = time.time() - start
+    full_labels = [frame_label(d) for d in detections]
+    full_intervals = get_label_intervals(args.classes, full_labels, args.video, args.merge_threshold_ms)
+    print(f"full scan:  {len(full_labels)} calls, {full_time:.2f}s")
+
+    for stride in args.stride:
+        start = time.time()
+        labels = yolo.search_video(args.classes, args.video, stride=stride, precision_ms=args.precision_ms)
+        search_time = time.time() - start
+        intervals = get_label_intervals(args.classes, labels, args.video, args.merge_threshold_ms)
+
+        n = min(len(labels), len(full_labels))
+        frame_agreement = sum(a == b for a, b in zip(labels, full_labels)) / max(n, 1)
+        class_agreement = sum(intervals[c] == full_intervals[c] for c in args.classes) / len(args.classes)
+        print(
+            f"stride {stride:>3}: {yolo.last_search_calls} calls, {search_time:.2f}s "
+            f"(x{full_time / max(search_time, 1e-9):.1f}), frame agreement {frame_agreement:.2%}, "
+            f"identical class intervals {class_agreement:.0%}"
+        )
+        for cls in args.classes:
+            if intervals[cls] != full_intervals[cls]:
+                print(f"  {cls}: full {full_intervals[cls]}\n  {' ' * len(cls)}  search {intervals[cls]}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .utils.llm import flush_files, QuotaExhausted
+from .agent import ViQAgent
+from itertools import groupby
+from tqdm import tqdm
+import threading
+import json
+import os
+
+PARQUET_CHUNK = 1000
+
+def read_dataset(path, id_key="id", video_key="video", question_key="question", options_key="options", video_dir=None):
+    """
+    Stream the items of a JSONL or Parquet dataset as dicts with keys 'id', 'video',
+    'question' and 'options'. Items without an id are identified by their row index.
+    """
+    def item(i, row):
+        video = row[video_key]
+        if video_dir is not None: video = os.path.join(video_dir, video)
+        return {
+            'id': str(row.get(id_key, i)),
+            'video': video,
+            'question': row[question_key],
+            'options': list(row.get(options_key) or []),
+        }
+
+    if path.endswith(".parquet"):
+        import polars as pl
+        lf = pl.scan_parquet(path)
+        n_rows = lf.select(pl.len()).collect().item()
+        for offset in range(0, n_rows, PARQUET_CHUNK):
+            chunk = lf.slice(offset, PARQUET_CHUNK).collect()
+            for i, row in enumerate(chunk.iter_rows(named=True)):
+                yield item(offset + i, row)
+    else:
+        with open(path) as f:
+            for i, line in enumerate(f):
+                if line.strip():
+                    yield item(i, json.loads(line))
+
+class Checkpoint():
+    """
+    Append-only JSONL file of results. Each record is written with a single write and fsync'ed,
+    and a partial last line (left by a killed process) is dropped when loading, so a record is
+    either fully in the file or not at all.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.completed = set()
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                f.truncate(end)
+        for line in data[:end].splitlines():
+            record = json.loads(line)
+            if 'error' not in record:
+                self.completed.add(record['id'])
+
+    def append(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            if 'error' not in record:
+                self.completed.add(record['id'])
+
+class Runner():
+    """
+    Run a `ViQAgent` over a dataset with bounded concurrency, checkpointing every result.
+    The dataset is streamed: each run of consecutive items sharing a video is submitted as soon as
+    it is read (with at most `2 * max_workers` runs waiting), and run sequentially by the same worker,
+    reusing the uploaded video. Different runs go in parallel (one agent per worker thread, built
+    by `agent_factory`), so a dataset sorted by video uploads each video once.
+    Re-running with the same checkpoint skips the completed items, and retries the failed ones.
+    If the API quota is exhausted (see `QuotaExhausted`), the run stops after recording that item,
+    and the items not run yet are left for the next run.
+    """
+    def __init__(self, agent_factory, checkpoint_path, max_workers=4, deadline=None, log=print):
+        self.agent_factory = agent_factory
+        self.deadline = deadline # per-item time budget (s), see `ViQAgent.invoke`
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.max_workers = max_workers
+        self.log = log
+        self.local = threading.local()
+        self.agents = []
+        self.stopped = threading.Event()
+
+    def agent(self):
+        if not hasattr(self.local, 'agent'):
+            self.local.agent = self.agent_factory()
+            self.agents.append(self.local.agent)
+        return self.local.agent
+
+    def run(self, items):
+        flush_files()
+        n_skipped = 0
+        pending = set()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor, tqdm(desc="ViQAgent") as progress:
+            for _, group in groupby(items, key=lambda item: item['video']):
+                if self.stopped.is_set():
+                    break
+                group = list(group)
+                todo = [item for item in group if item['id'] not in self.checkpoint.completed]
+                n_skipped += len(group) - len(todo)
+                if not todo:
+                    continue
+                pending.add(executor.submit(self.run_group, todo))
+                # read the dataset only as fast as the groups are run
+                if len(pending) >= 2 * self.max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    progress.update(sum(future.result() for future in done))
+            if self.stopped.is_set():
+                for future in pending: future.cancel()
+            done, _ = wait(pending)
+            progress.update(sum(future.result() for future in done if not future.cancelled()))
+            n_run = progress.n
+        for agent in self.agents:
+            agent.close()
+        self.log(f"Ran {n_run} items ({n_skipped} already completed)")
+        if self.stopped.is_set():
+            self.log("Stopped, the API quota is exhausted; run again with the same checkpoint to resume")
+
+    def run_group(self, group):
+        agent = self.agent()
+        try:
+            n_run = 0
+            for item in group:
+                if self.stopped.is_set():
+                    break
+                self.run_item(agent, item)
+                n_run += 1
+        finally:
+            try: agent.rm_cache()
+            except Exception as e: self.log(f"Could not remove the cached files of {group[0]['video']}: {e}")
+        return n_run
+
+    def run_item(self, agent, item):
+        record = dict(item)
+        try:
+            record['answer_vllm1'], record['answer'] = agent.invoke(item['video'], item['question'], item['options'], flush=False, deadline=self.deadline)
+            record.update(agent.last_invocation)
+        except Exception as e:
+            record['error'] = f"{type(e).__name__}: {e}"
+            self.log(f"Item {item['id']} failed: {record['error']}")
+            if isinstance(e, QuotaExhausted):
+                self.stopped.set()
+        self.checkpoint.append(record)
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    import argparse
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Run ViQAgent over a JSONL/Parquet dataset")
+    parser.add_argument("dataset", help="JSONL or Parquet file with (video, question, options) items")
+    parser.add_argument("checkpoint", help="JSONL file where results are appended (resumed if it exists)")
+    parser.add_argument("--model", default="gemini-1.5-flash")
+    parser.add_argument("--video-dir", default=None)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--subinstruction", default="")
+    parser.add_argument("--deadline", type=float, default=None, help="time budget per item (s)")
+    args = parser.parse_args()
+
+    api_key = os.environ["GOOGLE_API_KEY"]
+    factory = lambda: ViQAgent(args.model, api_key, args.subinstruction, log_config={'verbose': 'silent'})
+    runner = Runner(factory, args.checkpoint, max_workers=args.workers, deadline=args.deadline)
+    runner.run(read_dataset(args.dataset, video_dir=args.video_dir))
@@ -0,0 +1,68 @@
+import importlib.util
+import numpy as np
+import pytest
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the repository is a package (see the relative imports in agent.py), import it as `ViQAgent`
+# whatever the name of the folder it was cloned into
+if "ViQAgent" not in sys.modules:
+    package = importlib.util.module_from_spec(importlib.machinery.ModuleSpec("ViQAgent", None, is_package=True))
+    package.__path__ = [ROOT]
+    sys.modules["ViQAgent"] = package
+
+COLORS = {None: 0, "a": 100, "b": 200}
+
+class FakeBox():
+    def __init__(self, class_id, confidence):
+        self.xywh = np.array([[20.0, 20.0, 10.0, 10.0]])
+        self.cls = np.float32(class_id)
+        self.conf = np.float32(confidence)
+
+class FakeYOLOWorld():
+    """
+    Stands in for `inference`'s `YOLOWorld` (and the ultralytics model it wraps): a frame of
+    color `COLORS[c]` has one detection of the c-th class set (with classes ['a', 'b']).
+    """
+    def __init__(self, delay=0.0):
+        self.class_names = None
+        self.model = self
+        self.delay = delay
+        self.calls = 0
+
+    def set_classes(self, classes):
+        self.class_names = list(classes)
+
+    def preproc_image(self, image):
+        return image
+
+    def predict(self, images, conf, verbose=False):
+        results = []
+        for image in images:
+            self.calls += 1
+            time.sleep(self.delay)
+            value = image.mean()
+            boxes = [] if value < 50 else [FakeBox(0 if value < 150 else 1, 0.9)]
+            results.append(type("Results", (), {"boxes": boxes})())
+        return results
+
+def write_video(path, labels, fps=30):
+    import cv2
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), fps, (64, 64))
+    for label in labels:
+        writer.write(np.full((64, 64, 3), COLORS[label], dtype=np.uint8))
+    writer.release()
+    return str(path)
+
+@pytest.fixture
+def labels():
+    # runs of different lengths, including some shorter than the usual search strides
+    runs = [(None, 40), ("a", 75), (None, 3), ("a", 20), ("b", 120), (None, 60), ("b", 5), ("a", 90), (None, 30)]
+    return [label for label, n in runs for _ in range(n)]
+
+@pytest.fixture
+def video(tmp_path, labels):
+    return write_video(tmp_path / "video.avi", labels)
@@ -0,0 +1,25 @@
+from ViQAgent.agent import ViQAgent
+import pytest
+
+def test_search_stride_requires_a_detector_with_search():
+    with pytest.raises(ValueError, match="search_video"):
+        ViQAgent("model", "key", log_config={'verbose': 'silent'}, detector=object(), search_stride=30)
+
+class StubModel():
+    def __init__(self, response):
+        self.response = response
+
+    def __call__(self, *args, deadline=None):
+        return self.response, (1, 1)
+
+class TimingOutDetector():
+    def process_video(self, classes, source_video_path, deadline=None):
+        raise TimeoutError("Deadline exceeded during object grounding")
+
+def test_invoke_falls_back_to_vllm1_answer_on_timeout(video):
+    agent = ViQAgent("model", "key", log_config={'verbose': 'silent'}, detector=TimingOutDetector())
+    agent.videollm1 = StubModel({'reasoning': "r", 'answer': "1"})
+    agent.videollm2 = StubModel({'timeframes': []})
+    agent.videollm3 = StubModel({'targets': ["a"]})
+    assert agent.invoke(video, "question", ["x", "y"], flush=False, deadline=60) == ("1", "1")
+    assert agent.last_invocation['responses']['metadata']['degraded']
@@ -0,0 +1,81 @@
+from ViQAgent.utils.llm import LLM, QuotaExhausted, HEDGE_MIN_SAMPLES
+import ViQAgent.utils.llm as llm_module
+from ViQAgent.utils.utils import Deadline
+import threading
+import pytest
+import time
+
+class DeadlineExceeded(Exception):
+    pass
+
+class FakeModel():
+    """
+    `GenerativeModel.generate_content` answering the i-th call after `delays[i]` seconds,
+    or raising `DeadlineExceeded` (as the API does) if the request timeout is shorter.
+    """
+    def __init__(self, delays):
+        self.delays = delays
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def generate_content(self, ctx, request_options=None):
+        with self.lock:
+            i = self.calls
+            self.calls += 1
+        timeout = (request_options or {}).get("timeout")
+        if timeout is not None and self.delays[i] > timeout:
+            time.sleep(timeout)
+            raise DeadlineExceeded()
+        time.sleep(self.delays[i])
+        return f"response {i}"
+
+def make_llm(delays, n_latencies=HEDGE_MIN_SAMPLES, timeout=5):
+    llm = LLM("model", log=lambda *args: None, timeout=timeout, hedge_percentile=90)
+    llm._model = FakeModel(delays)
+    llm.latencies.extend([0.05] * n_latencies)
+    return llm
+
+def test_slow_request_is_hedged():
+    llm = make_llm([2, 0])
+    start = time.time()
+    assert llm.generate(["query"]) == "response 1"
+    assert time.time() - start < 1
+    assert llm._model.calls == 2
+
+def test_no_hedge_before_enough_latencies():
+    llm = make_llm([0.3, 0], n_latencies=HEDGE_MIN_SAMPLES - 1)
+    assert llm.hedge_delay() is None
+    assert llm.generate(["query"]) == "response 0"
+    assert llm._model.calls == 1
+
+def test_exhausted_deadline_raises_timeout():
+    llm = make_llm([2, 2])
+    start = time.time()
+    with pytest.raises(TimeoutError):
+        llm.generate(["query"], Deadline(0.2))
+    assert time.time() - start < 1
+
+def test_hedging_requires_a_timeout():
+    with pytest.raises(ValueError, match="timeout"):
+        LLM("model", hedge_percentile=90)
+
+class ResourceExhausted(Exception):
+    pass
+
+class ExhaustedModel():
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, ctx, request_options=None):
+        self.calls += 1
+        raise ResourceExhausted("429 Resource has been exhausted")
+
+def test_llm_raises_quota_exhausted_after_retries(monkeypatch):
+    monkeypatch.setattr(llm_module, "MAX_RETRIES", 2)
+    monkeypatch.setattr(llm_module, "current_retry_delay", 0)
+    monkeypatch.setattr(llm_module, "RETRY_DELAY_INCREASE", 0)
+    llm = LLM("model", log=lambda *args: None)
+    llm._model = ExhaustedModel()
+    with pytest.raises(QuotaExhausted):
+        llm("query")
+    assert llm._model.calls == 3
@@ -0,0 +1,99 @@
+from ViQAgent.runner import Runner, Checkpoint, read_dataset
+from ViQAgent.utils.llm import QuotaExhausted
+import ViQAgent.runner as runner
+import json
+import pytest
+
+class StubAgent():
+    def __init__(self, fail_on=(), quota_on=()):
+        self.fail_on = fail_on
+        self.quota_on = quota_on
+        self.invoked = []
+
+    def invoke(self, video, query, answer_options=[], flush=True, deadline=None):
+        self.invoked.append(query)
+        if query in self.quota_on: raise QuotaExhausted("ResourceExhausted, max retries reached (20)")
+        if query in self.fail_on: raise ValueError("bad item")
+        self.last_invocation = {'responses': {}, 'usages': {}, 'delays': {}}
+        return "a1", "a2"
+
+    def rm_cache(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture(autouse=True)
+def no_flush(monkeypatch):
+    monkeypatch.setattr(runner, "flush_files", lambda: None)
+
+def make_items(n_videos=3, per_video=3):
+    return [
+        {'id': f"{v}-{q}", 'video': f"v{v}.mp4", 'question': f"q{v}-{q}", 'options': []}
+        for v in range(n_videos) for q in range(per_video)
+    ]
+
+def read_records(path):
+    return [json.loads(line) for line in open(path)]
+
+def test_checkpoint_drops_partial_last_line(tmp_path):
+    path = tmp_path / "checkpoint.jsonl"
+    path.write_text('{"id": "a"}\n{"id": "b", "error": "x"}\n{"id": "c", "ans')
+    checkpoint = Checkpoint(str(path))
+    assert checkpoint.completed == {"a"}
+    checkpoint.append({"id": "d"})
+    assert [r["id"] for r in read_records(path)] == ["a", "b", "d"]
+    assert checkpoint.completed == {"a", "d"}
+
+def test_read_dataset_jsonl(tmp_path):
+    path = tmp_path / "data.jsonl"
+    path.write_text('{"video": "v.mp4", "question": "q"}\n\n{"id": 7, "video": "w.mp4", "question": "q2", "options": ["x"]}\n')
+    items = list(read_dataset(str(path), video_dir="videos"))
+    assert items == [
+        {'id': '0', 'video': 'videos/v.mp4', 'question': 'q', 'options': []},
+        {'id': '7', 'video': 'videos/w.mp4', 'question': 'q2', 'options': ['x']},
+    ]
+
+def test_resume_skips_completed_and_retries_failed(tmp_path):
+    path = str(tmp_path / "checkpoint.jsonl")
+    Runner(lambda: StubAgent(fail_on={"q1-1"}), path, max_workers=2, log=lambda m: None).run(make_items())
+    records = read_records(path)
+    assert len(records) == 9 and [r["id"] for r in records if "error" in r] == ["1-1"]
+
+    agent = StubAgent()
+    Runner(lambda: agent, path, max_workers=1, log=lambda m: None).run(make_items())
+    assert agent.invoked == ["q1-1"] and agent.closed
+    assert {r["id"] for r in read_records(path) if "error" not in r} == {i["id"] for i in make_items()}
+
+def test_quota_exhausted_is_recorded_and_stops_the_run(tmp_path):
+    path = str(tmp_path / "checkpoint.jsonl")
+    agent = StubAgent(quota_on={"q0-1"})
+    Runner(lambda: agent, path, max_workers=1, log=lambda m: None).run(make_items())
+    assert agent.invoked == ["q0-0", "q0-1"]
+    records = read_records(path)
+    assert [r["id"] for r in records] == ["0-0", "0-1"]
+    assert records[1]["error"].startswith("QuotaExhausted")
+
+    agent = StubAgent()
+    Runner(lambda: agent, path, max_workers=1, log=lambda m: None).run(make_items())
+    assert agent.invoked == [i["question"] for i in make_items()][1:]
+
+def test_run_streams_the_dataset(tmp_path):
+    items = make_items(n_videos=6, per_video=2)
+    read = []
+    def stream():
+        for item in items:
+            read.append(item['id'])
+            yield item
+
+    class RecordingAgent(StubAgent):
+        def invoke(self, video, query, *args, **kwargs):
+            self.n_read.append(len(read))
+            return super().invoke(video, query, *args, **kwargs)
+
+    agent = RecordingAgent()
+    agent.n_read = []
+    Runner(lambda: agent, str(tmp_path / "checkpoint.jsonl"), max_workers=1, log=lambda m: None).run(stream())
+    # at most 2 groups are waiting for the worker, plus the item read to end the last one
+    assert agent.n_read[0] <= 5
+    assert agent.invoked == [i["question"] for i in items]
@@ -0,0 +1,22 @@
+from ViQAgent.utils.utils import Deadline
+import pytest
+import time
+
+def test_unbounded_deadline():
+    deadline = Deadline()
+    assert deadline.remaining() == float('inf') and not deadline.expired()
+    assert deadline.timeout() is None
+    assert deadline.timeout(5) == 5
+
+def test_deadline_caps_timeouts():
+    deadline = Deadline(10)
+    assert 9 < deadline.timeout() <= 10
+    assert deadline.timeout(2) == 2
+    assert 9 < deadline.timeout(60) <= 10
+
+def test_expired_deadline():
+    deadline = Deadline(0.01)
+    time.sleep(0.02)
+    assert deadline.expired()
+    with pytest.raises(TimeoutError):
+        deadline.timeout(5)
@@ -0,0 +1,159 @@
+from ViQAgent.utils.utils import Deadline, frame_label, get_label_intervals, get_object_intervals
+from ViQAgent.utils.yolo import YOLO, infer_batch, combine_stage_stats
+from conftest import ROOT, FakeYOLOWorld, write_video
+import supervision as sv
+import numpy as np
+import pytest
+import time
+import os
+
+def test_infer_batch_matches_from_inference_format():
+    model = FakeYOLOWorld()
+    model.set_classes(["a", "b"])
+    frames = [np.full((64, 64, 3), v, dtype=np.uint8) for v in (0, 100, 200)]
+    empty, a, b = infer_batch(model, frames, confidence=0.01)
+    assert len(empty) == 0
+    assert list(a.data["class_name"]) == ["a"] and list(b.data["class_name"]) == ["b"]
+    assert list(b.class_id) == [1]
+    np.testing.assert_allclose(a.xyxy, [[15.0, 15.0, 25.0, 25.0]])
+
+def test_infer_batch_matches_yoloworld_infer():
+    yolo_world = pytest.importorskip("inference.models.yolo_world.yolo_world")
+    model = yolo_world.YOLOWorld.__new__(yolo_world.YOLOWorld)
+    model.model = FakeYOLOWorld()
+    model.class_names = ["a", "b"]
+    model.model.class_names = model.class_names
+    for value in (0, 100, 200):
+        frame = np.full((64, 64, 3), value, dtype=np.uint8)
+        expected = sv.Detections.from_inference(model.infer(frame, confidence=0.01))
+        (detections,) = infer_batch(model, [frame], confidence=0.01)
+        np.testing.assert_allclose(detections.xyxy, expected.xyxy)
+        np.testing.assert_allclose(detections.confidence, expected.confidence)
+        assert list(detections.data.get("class_name", [])) == list(expected.data.get("class_name", []))
+
+def make_yolo(**kwargs):
+    yolo = YOLO(**kwargs)
+    yolo._model = FakeYOLOWorld()
+    return yolo
+
+def full_scan_labels(yolo, video):
+    return [frame_label(d) for d in yolo.process_video(["a", "b"], video)]
+
+@pytest.mark.parametrize("stride", [2, 3])
+def test_search_matches_full_scan_when_runs_are_longer_than_stride(video, labels, stride):
+    yolo = make_yolo(pipeline=False)
+    assert full_scan_labels(yolo, video) == labels
+
+    yolo._model.calls = 0
+    searched = yolo.search_video(["a", "b"], video, stride=stride)
+    assert yolo.last_search_calls == yolo._model.calls < len(labels)
+    assert searched == labels
+    assert get_label_intervals(["a", "b"], searched, video) == get_object_intervals(["a", "b"], yolo.process_video(["a", "b"], video), video)
+
+def test_search_calls_scale_with_transitions(tmp_path):
+    labels = [None] * 200 + ["a"] * 300 + ["b"] * 250 + [None] * 150
+    video = write_video(tmp_path / "long_runs.avi", labels)
+    yolo = make_yolo()
+    assert yolo.search_video(["a", "b"], video, stride=32) == labels
+    # one call per stride, plus a bisection of log2(32) calls per transition
+    assert yolo.last_search_calls <= len(labels) // 32 + 2 + 3 * 5
+
+STUB_YOLO_WORLD = """
+from conftest import FakeYOLOWorld
+
+class YOLOWorld(FakeYOLOWorld):
+    def __init__(self, model_id):
+        super().__init__()
+"""
+
+def test_parallel_segments_match_serial_scan(tmp_path, monkeypatch, video, labels):
+    # the spawned workers import the package and load the model themselves
+    stub = tmp_path / "stub"
+    (stub / "inference" / "models" / "yolo_world").mkdir(parents=True)
+    (stub / "inference" / "models" / "yolo_world" / "yolo_world.py").write_text(STUB_YOLO_WORLD)
+    os.symlink(ROOT, stub / "ViQAgent")
+    monkeypatch.syspath_prepend(os.path.join(ROOT, "tests"))
+    monkeypatch.syspath_prepend(str(stub))
+
+    yolo = make_yolo(workers=3, segment_seconds=20 / 30 + 1e-6) # 20 frames per segment
+    try:
+        detections = yolo.process_video(["a", "b"], video)
+    finally:
+        yolo.close()
+    assert yolo.stage_stats['segments'] == 23 and yolo.stage_stats['frames'] == len(labels)
+    assert [frame_label(d) for d in detections] == labels
+    serial = make_yolo(pipeline=False).process_video(["a", "b"], video)
+    assert get_object_intervals(["a", "b"], detections, video) == get_object_intervals(["a", "b"], serial, video)
+
+def test_search_without_frame_count_falls_back_to_full_scan(video, labels, monkeypatch):
+    from_video_path = sv.VideoInfo.from_video_path
+    def unknown_frame_count(path):
+        info = from_video_path(path)
+        info.total_frames = 0
+        return info
+    monkeypatch.setattr(sv.VideoInfo, "from_video_path", unknown_frame_count)
+    yolo = make_yolo()
+    assert yolo.search_video(["a", "b"], video, stride=30) == labels
+    assert yolo.last_search_calls == len(labels)
+
+def test_search_may_miss_presences_shorter_than_stride(video, labels):
+    searched = make_yolo().search_video(["a", "b"], video, stride=16)
+    assert len(searched) == len(labels)
+    assert sum(a == b for a, b in zip(searched, labels)) / len(labels) > 0.9
+
+@pytest.mark.parametrize("pipeline", [True, False])
+def test_process_video_stops_at_deadline(video, pipeline):
+    yolo = make_yolo(pipeline=pipeline)
+    yolo._model.delay = 0.01
+    start = time.time()
+    with pytest.raises(TimeoutError):
+        yolo.process_video(["a", "b"], video, deadline=Deadline(0.2))
+    assert time.time() - start < 1
+
+def test_search_stops_at_deadline(video):
+    yolo = make_yolo()
+    yolo._model.delay = 0.01
+    with pytest.raises(TimeoutError):
+        yolo.search_video(["a", "b"], video, stride=2, deadline=Deadline(0.1))
+
+def test_pipeline_matches_serial_loop_in_order(video, labels):
+    yolo = make_yolo(pipeline=True, prefetch=2, post_queue=2)
+    yolo._model.delay = 0.0005
+    pipelined = yolo.process_video(["a", "b"], video)
+    assert [frame_label(d) for d in pipelined] == labels
+    assert set(yolo.stage_stats) == {'decode', 'infer', 'postprocess', 'wall', 'frames'}
+    assert yolo.stage_stats['frames'] == len(labels)
+    assert all(0 <= yolo.stage_stats[stage] <= 1 for stage in ('decode', 'infer', 'postprocess'))
+
+    serial = make_yolo(pipeline=False).process_video(["a", "b"], video)
+    for p, s in zip(pipelined, serial):
+        np.testing.assert_array_equal(p.xyxy, s.xyxy)
+
+@pytest.mark.parametrize("stage", ["infer", "postprocess"])
+def test_pipeline_propagates_errors(video, monkeypatch, stage):
+    yolo = make_yolo(prefetch=2, post_queue=2)
+    def fail(*args):
+        raise RuntimeError(stage)
+    monkeypatch.setattr(yolo, stage, fail)
+    with pytest.raises(RuntimeError, match=stage):
+        yolo.process_video(["a", "b"], video)
+
+def test_pipeline_propagates_decoding_errors():
+    def frames():
+        yield np.zeros((64, 64, 3), dtype=np.uint8)
+        raise IOError("corrupted frame")
+    with pytest.raises(IOError, match="corrupted"):
+        make_yolo().run_pipeline(frames(), 64 * 64, progress=False)
+
+def test_combine_stage_stats():
+    segments = [
+        {'decode': 0.5, 'infer': 1.0, 'postprocess': 0.1, 'wall': 2.0, 'frames': 60},
+        {'decode': 0.2, 'infer': 0.5, 'postprocess': 0.4, 'wall': 1.0, 'frames': 30},
+        None,
+    ]
+    combined = combine_stage_stats(segments, wall=1.5)
+    assert combined['decode'] == pytest.approx(1.2 / 3)
+    assert combined['infer'] == pytest.approx(2.5 / 3)
+    assert combined['postprocess'] == pytest.approx(0.6 / 3)
+    assert (combined['wall'], combined['frames'], combined['segments']) == (1.5, 90, 2)
+    assert combine_stage_stats([None], wall=1.0) is None
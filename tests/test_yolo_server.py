@@ -0,0 +1,85 @@
+from ViQAgent.utils.yolo_server import YOLOServer, YOLOClient
+from multiprocessing import shared_memory
+from conftest import FakeYOLOWorld
+import numpy as np
+import pytest
+import threading
+import queue
+
+def make_server(max_batch=32):
+    server = YOLOServer.__new__(YOLOServer)
+    server.model = FakeYOLOWorld()
+    server.set_classes = server.model.set_classes # the embeddings cache needs the real model
+    server.max_batch = max_batch
+    server.responses, server.lock = {}, threading.Lock()
+    return server
+
+def submit(server, client, values, classes, confidence=0.01):
+    frames = np.stack([np.full((64, 64, 3), v, dtype=np.uint8) for v in values])
+    shm = shared_memory.SharedMemory(create=True, size=frames.nbytes)
+    np.ndarray(frames.shape, dtype=np.uint8, buffer=shm.buf)[:] = frames
+    server._get_responses(client)
+    request = {"client": client, "id": f"{client}-{len(values)}", "shm": shm.name, "shape": frames.shape, "classes": classes, "confidence": confidence}
+    return request, shm
+
+def class_names(response):
+    return [list(d.data.get("class_name", [])) for d in response]
+
+def test_process_batch_answers_each_client_with_its_own_classes():
+    server = make_server(max_batch=2)
+    a, shm_a = submit(server, "a", [0, 100, 200], ["a", "b"])
+    b, shm_b = submit(server, "b", [200, 100], ["b", "a"])
+    c, shm_c = submit(server, "c", [100, 0], ["a", "b"])
+    try:
+        server.process_batch([a, b, c])
+    finally:
+        for shm in (shm_a, shm_b, shm_c):
+            shm.close()
+            shm.unlink()
+
+    # the same vocabulary as running each client alone, whatever else is in the batch
+    request_id, response = server.responses["a"].get_nowait()
+    assert request_id == "a-3" and class_names(response) == [[], ["a"], ["b"]]
+    request_id, response = server.responses["c"].get_nowait()
+    assert request_id == "c-2" and class_names(response) == [["a"], []]
+    _, response = server.responses["b"].get_nowait()
+    assert class_names(response) == [["a"], ["b"]]
+    assert list(response[0].class_id) == [1]
+    assert server.model.calls == 7
+    assert all(q.empty() for q in server.responses.values())
+
+def test_process_batch_fails_only_the_request_with_a_missing_block():
+    server = make_server()
+    a, shm_a = submit(server, "a", [100, 200], ["a", "b"])
+    b, shm_b = submit(server, "b", [100], ["a", "b"])
+    shm_b.close()
+    shm_b.unlink() # the client gave up on the request
+    try:
+        server.process_batch([b, a])
+    finally:
+        shm_a.close()
+        shm_a.unlink()
+
+    request_id, response = server.responses["b"].get_nowait()
+    assert request_id == "b-1" and isinstance(response, FileNotFoundError)
+    request_id, response = server.responses["a"].get_nowait()
+    assert request_id == "a-2" and class_names(response) == [["a"], ["b"]]
+
+def test_responses_of_released_clients_are_dropped():
+    server = make_server()
+    a, shm_a = submit(server, "a", [100], ["a"])
+    server._release_responses("a")
+    try:
+        server.process_batch([a])
+    finally:
+        shm_a.close()
+        shm_a.unlink()
+    assert server.responses == {}
+
+def test_client_times_out_without_server_response():
+    client = YOLOClient.__new__(YOLOClient)
+    client.client_id, client.confidence, client.timeout = "client", 0.01, 0.1
+    client.requests, client.responses = queue.Queue(), queue.Queue()
+    with pytest.raises(TimeoutError):
+        client.warmup()
+    assert client.requests.qsize() == 1
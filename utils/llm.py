@@ -1,4 +1,6 @@
-import google.generativeai as genai
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+from .utils import Deadline
 import json
 import time
 import os
@@ -7,6 +9,27 @@ MAX_RETRIES = 20
 RETRY_DELAY_START = 10
 RETRY_DELAY_INCREASE = 5
 current_retry_delay = RETRY_DELAY_START
+LATENCY_WINDOW = 100
+HEDGE_MIN_SAMPLES = 10
+
+hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+
+# google.generativeai is slow to import, so it is only loaded on first use
+_genai = None
+_api_key = None
+
+def configure(api_key):
+    global _api_key
+    _api_key = api_key
+    if _genai is not None: _genai.configure(api_key=api_key)
+
+def load_genai():
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        if _api_key is not None: genai.configure(api_key=_api_key)
+        _genai = genai
+    return _genai
 
 safe = [
     {
@@ -27,9 +50,15 @@ safe = [
     },
 ]
 
+class QuotaExhausted(Exception):
+    pass
+
 class LLM:
-    def __init__(self, model_name, system_prompt=None, json_schema=None, temperature=0.0, seed=None, api_key=None, log=print):
-        if api_key is not None: genai.configure(api_key=api_key)
+    def __init__(self, model_name, system_prompt=None, json_schema=None, temperature=0.0, seed=None, api_key=None, log=print, timeout=None, hedge_percentile=None):
+        if hedge_percentile is not None and timeout is None:
+            # the losing requests keep running until their timeout, in the shared `hedge_executor`
+            raise ValueError("hedge_percentile requires a per-call timeout")
+        if api_key is not None: configure(api_key)
         genconf = {
             "temperature":temperature,
         }
@@ -39,25 +68,104 @@ class LLM:
         if seed is not None:
             genconf["seed"] = seed
 
-        self.model = genai.GenerativeModel(
-            model_name=model_name,
-            system_instruction=system_prompt,
-            generation_config=genconf,
-            safety_settings=safe
-        )
+        self.model_config = {
+            "model_name": model_name,
+            "system_instruction": system_prompt,
+            "generation_config": genconf,
+            "safety_settings": safe
+        }
+        self._model = None
         self.json_schema = json_schema
         self.log = log
+        self.timeout = timeout                      # per-call timeout (s)
+        self.hedge_percentile = hedge_percentile    # send a duplicate request after this latency percentile
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = load_genai().GenerativeModel(**self.model_config)
+        return self._model
+
+    def hedge_delay(self):
+        if self.hedge_percentile is None or len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[int(self.hedge_percentile / 100 * (len(latencies) - 1))]
+
+    def _generate(self, ctx, timeout):
+        start = time.time()
+        try:
+            r = self.model.generate_content(ctx, request_options={"timeout": timeout} if timeout is not None else None)
+        except Exception as e:
+            if str(type(e).__name__) == "DeadlineExceeded":
+                raise TimeoutError(f"Model call exceeded its timeout ({timeout}s)")
+            raise e
+        self.latencies.append(time.time() - start)
+        return r
 
-    def __call__(self, query):
+    def generate(self, ctx, deadline=None):
+        """
+        `generate_content` bounded by `self.timeout` and the remaining `deadline`. With hedging
+        enabled, a duplicate request is sent if the first one is slower than the configured
+        percentile of the previous latencies, and the first successful response is returned.
+        """
+        deadline = deadline or Deadline()
+        timeout = deadline.timeout(self.timeout)
+        hedge_after = self.hedge_delay()
+        if hedge_after is None:
+            return self._generate(ctx, timeout)
+
+        futures = [hedge_executor.submit(self._generate, ctx, timeout)]
+        done, _ = wait(futures, timeout=min(hedge_after, timeout or float('inf')))
+        if not done and not deadline.expired():
+            self.log(f"No response after {hedge_after:.1f}s, sending a hedged request")
+            futures.append(hedge_executor.submit(self._generate, ctx, deadline.timeout(self.timeout)))
+
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=deadline.timeout(self.timeout), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = error or future.exception()
+        raise error or TimeoutError("Deadline exceeded waiting for the model")
+
+    def wait_retry(self, retry_count, deadline=None):
+        """
+        Wait before retrying a call that got ResourceExhausted, with a delay increasing on every
+        retry. Raises QuotaExhausted after MAX_RETRIES, or TimeoutError if `deadline` can't wait.
+        """
+        global current_retry_delay
+        if deadline is not None and deadline.remaining() < current_retry_delay:
+            raise TimeoutError(f"ResourceExhausted, no time left to retry [{current_retry_delay}s]")
+        if retry_count >= MAX_RETRIES:
+            raise QuotaExhausted(f"ResourceExhausted, max retries reached ({MAX_RETRIES})")
+        self.log(f"ResourceExhausted, retrying ({retry_count+1}/{MAX_RETRIES}) [{current_retry_delay}s]")
+        time.sleep(current_retry_delay)
+        current_retry_delay += RETRY_DELAY_INCREASE
+
+    def __call__(self, query, retry_count=0, deadline=None):
+        global current_retry_delay
         ctx = [query]
-        r = self.model.generate_content(ctx)
+        try:
+            r = self.generate(ctx, deadline)
+        except Exception as e:
+            if str(type(e).__name__) == "ResourceExhausted":
+                self.wait_retry(retry_count, deadline)
+                return self(query, retry_count+1, deadline)
+            raise e
+        current_retry_delay = RETRY_DELAY_START
         response = r.text
         if self.json_schema is not None: response = json.loads(response)
         else: response = response
         return response, (r.usage_metadata.prompt_token_count, r.usage_metadata.candidates_token_count)
 
 class VLLM(LLM):
-    def __call__(self, content_paths, query, retry_count=0):
+    def __call__(self, content_paths, query, retry_count=0, deadline=None):
         global current_retry_delay
         if isinstance(content_paths, str): content_paths = [content_paths]
         self.last_execution_files = []
@@ -67,11 +175,11 @@ class VLLM(LLM):
                 if content_path.startswith("http"):
                     raise ValueError("URL download not implemented yet")
                 else:
-                    file = upload_file(content_path)
+                    file = upload_file(content_path, deadline)
                     ctx.append(file)
                     self.last_execution_files.append(file)
                 ctx.append(query)
-            r = self.model.generate_content(ctx)
+            r = self.generate(ctx, deadline)
             response = r.text
             # Example of blocked-prompt error: ValueError: Invalid operation: The `response.parts` quick accessor requires a single candidate, but but `response.candidates` is empty. This appears to be caused by a blocked prompt, see `response.prompt_feedback`: block_reason: OTHER
             if self.json_schema is not None: response = json.loads(response)
@@ -79,20 +187,16 @@ class VLLM(LLM):
         except Exception as e:
             errortype = str(type(e).__name__)
             if errortype == "ResourceExhausted":
-                if retry_count < MAX_RETRIES:
-                    self.log(f"ResourceExhausted, retrying ({retry_count+1}/{MAX_RETRIES}) [{current_retry_delay}s]")
-                    time.sleep(current_retry_delay)
-                    current_retry_delay += RETRY_DELAY_INCREASE
-                    return self(content_paths, query, retry_count+1)
-                else:
-                    exit(f"ResourceExhausted, max retries reached ({MAX_RETRIES})")
+                self.wait_retry(retry_count, deadline)
+                return self(content_paths, query, retry_count+1, deadline)
             else:
                 raise e
         current_retry_delay = RETRY_DELAY_START
         return response, (r.usage_metadata.prompt_token_count, r.usage_metadata.candidates_token_count)
 
 # note: try as much as possible that the names differ when they are different inputs; if not, it will lead to prev-content conflict
-def upload_file(path):
+def upload_file(path, deadline=None):
+    genai = load_genai()
     existing = { file.display_name:file for file in list_files() }
     file_name = os.path.basename(path)
     
@@ -101,6 +205,8 @@ def upload_file(path):
     else:
         file = genai.upload_file(path=path)
         while file.state.name == "PROCESSING":
+            if deadline is not None and deadline.remaining() < 2:
+                raise TimeoutError(f"Deadline exceeded while processing file: {file.uri} ({file.display_name})")
             time.sleep(2)
             file = genai.get_file(file.name)
         if file.state.name == "FAILED":
@@ -110,11 +216,11 @@ def upload_file(path):
 def remove_files(files):
     if not hasattr(files, "__iter__"): files = [files]
     for file in files:
-        genai.delete_file(file.name)
+        load_genai().delete_file(file.name)
 
 def list_files():
-    return genai.list_files()
+    return load_genai().list_files()
 
 def flush_files():
     for file in list_files():
-        genai.delete_file(file.name)
+        load_genai().delete_file(file.name)
@@ -1,24 +1,46 @@
 from datetime import timedelta
-import supervision as sv
-from PIL import Image
+import threading
 import time
-import cv2
 import re
 import os
-os.makedirs('tmp', exist_ok=True)
+# supervision, cv2 and PIL are imported where used, to keep importing the agent fast
 
-last_time = 0
+# per-thread, so that concurrent agents (e.g. in `runner.py`) don't mix their timings
+_timer = threading.local()
 
 def tic():
-    global last_time
-    last_time = time.time()
+    _timer.last_time = time.time()
 
 def toc():
-    global last_time
-    diff = time.time() - last_time
-    last_time = time.time()
+    diff = time.time() - getattr(_timer, 'last_time', 0)
+    _timer.last_time = time.time()
     return diff
 
+class Deadline():
+    """
+    Time budget of an invocation, shared by all its stages. `Deadline(None)` never expires.
+    """
+    def __init__(self, seconds=None):
+        self.end = time.time() + seconds if seconds is not None else None
+
+    def remaining(self):
+        return self.end - time.time() if self.end is not None else float('inf')
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, timeout=None):
+        """
+        The given per-call timeout capped to the remaining budget (None if both are unbounded).
+        Raises TimeoutError if the budget is already exhausted.
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise TimeoutError("Deadline exceeded")
+        if timeout is None:
+            return remaining if self.end is not None else None
+        return min(timeout, remaining)
+
 pattern = r"<<(\d{2}:\d{2}),(\d{2}:\d{2})>>(?:\s*:\s*(.*))?"
 def extract_timeframe(text):
     match = re.search(pattern, text)
@@ -51,6 +73,8 @@ def extract_frame_from_video(video_path, time_str):
     Extract a frame from the video at the given timestamp (time_str: '00:00:10' for 10th second).
     Returns a PIL image.
     """
+    from PIL import Image
+    import cv2
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         raise ValueError("Error opening video file")
@@ -67,6 +91,7 @@ def extract_frame_from_video(video_path, time_str):
 
     cap.release()
 
+    os.makedirs('tmp', exist_ok=True)
     frame_path = f"./tmp/frame_{frame_time}.png"
     frame = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
     frame.save(frame_path)
@@ -96,14 +121,24 @@ def merge_intervals(intervals, merge_threshold_ms, fps):
                 merged.append((start, end))
     return merged
 
+def frame_label(detections):
+    # a frame is attributed to the class of its first detection only
+    if "class_name" in detections.data and len(detections.data["class_name"]) > 0:
+        return detections.data['class_name'][0]
+    return None
+
 def get_object_intervals(classes, detections, source_video_path, merge_threshold_ms=1500):
+    labels = [frame_label(detection) for detection in detections]
+    return get_label_intervals(classes, labels, source_video_path, merge_threshold_ms)
+
+def get_label_intervals(classes, labels, source_video_path, merge_threshold_ms=1500):
+    import supervision as sv
     video_info = sv.VideoInfo.from_video_path(source_video_path)
     object_intervals = {cls: [] for cls in classes}
     last_frames = {cls: None for cls in classes}
 
-    for frame, detection in enumerate(detections):
-        if "class_name" in detection.data and len(detection.data["class_name"]) > 0:
-            class_name = detection.data['class_name'][0]
+    for frame, class_name in enumerate(labels):
+        if class_name is not None:
             if last_frames[class_name] is not None and frame == last_frames[class_name] + 1:
                 start_frame, _ = object_intervals[class_name][-1]
                 object_intervals[class_name][-1] = (start_frame, frame)
@@ -133,6 +168,7 @@ def get_object_intervals(classes, detections, source_video_path, merge_threshold
     return result
 
 def save_detections_video(detections_list, source_video_path, target_video_path):
+    import supervision as sv
     bounding_box_annotator = sv.BoundingBoxAnnotator(thickness=1)
     label_annotator = sv.LabelAnnotator(text_thickness=1, text_scale=0.5, text_color=sv.Color.BLACK)
     frame_generator = sv.get_video_frames_generator(source_video_path)
@@ -150,6 +186,7 @@ def CustomException(name, message):
     return exception_class(message)
 
 def get_video_duration(video_path):
+    import cv2
     video = cv2.VideoCapture(video_path)
     if not video.isOpened():
         raise ValueError(f"Could not open video file: {video_path}")
@@ -177,6 +214,7 @@ def trim_video(video_path, time_range):
     Returns:
         str: Path to the saved trimmed video file.
     """
+    import cv2
     # Parse the time range
     start_time, end_time = time_range.split(',')
     start_seconds = int(start_time.split(':')[0]) * 60 + int(start_time.split(':')[1])
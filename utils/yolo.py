@@ -1,25 +1,339 @@
-from inference.models.yolo_world.yolo_world import YOLOWorld
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+import multiprocessing as mp
+from .utils import frame_label
 import supervision as sv
 from tqdm import tqdm
+import numpy as np
+import threading
+import queue
+import time
+import cv2
+
+_worker_yolo = None
+_END = object()
+
+def _init_worker(model_id, confidence, nms_threshold, pipeline, prefetch, post_queue):
+    global _worker_yolo
+    _worker_yolo = YOLO(model_id, confidence, nms_threshold, pipeline=pipeline, prefetch=prefetch, post_queue=post_queue)
+    _worker_yolo.warmup()
+
+def _warmup_worker():
+    pass
+
+def _process_segment(classes, source_video_path, start, end, deadline=None):
+    detections_list = _worker_yolo.process_segment(classes, source_video_path, start, end, progress=False, deadline=deadline)
+    return detections_list, _worker_yolo.stage_stats
+
+def combine_stage_stats(segment_stats, wall):
+    """
+    Utilization of each stage over all the segments (busy time over the segments' wall time),
+    with the overall `wall` time, frames and segments.
+    """
+    segment_stats = [stats for stats in segment_stats if stats is not None]
+    if not segment_stats:
+        return None
+    segments_wall = sum(stats['wall'] for stats in segment_stats)
+    stages = [stage for stage in segment_stats[0] if stage not in ('wall', 'frames')]
+    combined = { stage: sum(stats[stage] * stats['wall'] for stats in segment_stats) / segments_wall for stage in stages }
+    return combined | { 'wall': wall, 'frames': sum(stats['frames'] for stats in segment_stats), 'segments': len(segment_stats) }
+
+def check_deadline(deadline):
+    if deadline is not None and deadline.expired():
+        raise TimeoutError("Deadline exceeded during object grounding")
+
+def infer_batch(model, frames, confidence):
+    """
+    `YOLOWorld.infer` for a batch of frames, with the classes currently set on `model`: same
+    preprocessing, and the same response format converted with `sv.Detections.from_inference`.
+    Shared by `YOLO` and `YOLOServer`, so both produce the same detections.
+    """
+    images = [model.preproc_image(frame) for frame in frames]
+    results = model.model.predict(images, conf=confidence, verbose=False)
+    detections_list = []
+    for image, result in zip(images, results):
+        predictions = []
+        for box in result.boxes:
+            x, y, w, h = box.xywh.tolist()[0]
+            class_id = int(box.cls)
+            predictions.append({
+                "x": x, "y": y, "width": w, "height": h,
+                "confidence": float(box.conf),
+                "class": model.class_names[class_id],
+                "class_id": class_id,
+            })
+        detections_list.append(sv.Detections.from_inference({
+            "predictions": predictions,
+            "image": {"width": image.shape[1], "height": image.shape[0]},
+        }))
+    return detections_list
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _END
 
 class YOLO():
-    def __init__(self, model_id="yolo_world/l", confidence=0.01, nms_threshold=0.1):
-        self.model = YOLOWorld(model_id=model_id)
+    def __init__(self, model_id="yolo_world/l", confidence=0.01, nms_threshold=0.1, workers=1, segment_seconds=60, pipeline=True, prefetch=16, post_queue=16):
+        self._model = None
+        self.model_id = model_id
         self.confidence = confidence
         self.nms_threshold = nms_threshold
+        self.workers = workers
+        self.segment_seconds = segment_seconds
+        self.pipeline = pipeline        # overlap decoding, inference and post-processing
+        self.prefetch = prefetch        # max decoded frames waiting for inference
+        self.post_queue = post_queue    # max inference results waiting for post-processing
+        self.stage_stats = None
+        self.pool = None
+
+    @property
+    def model(self):
+        # loaded on first use (or by `warmup`), as importing and loading it takes a while
+        if self._model is None:
+            try: from inference.models.yolo_world.yolo_world import YOLOWorld
+            except: raise ImportError("YOLO-World requires GPU, but no GPU was found")
+            self._model = YOLOWorld(model_id=self.model_id)
+        return self._model
 
-    def process_video(self, classes, source_video_path):
+    def warmup(self, classes=["person"]):
+        """
+        Load the model, compute the embeddings of `classes` and run a dummy inference.
+        In long-video mode, also start the worker processes (which warm up their own model).
+        """
         self.model.set_classes(classes)
+        self.detect(np.zeros((640, 640, 3), dtype=np.uint8), 640 * 640)
+        if self.workers > 1:
+            pool = self.get_pool()
+            for future in [pool.submit(_warmup_worker) for _ in range(self.workers)]:
+                future.result()
 
-        frame_generator = sv.get_video_frames_generator(source_video_path)
+    def process_video(self, classes, source_video_path, deadline=None):
+        """
+        Detections of every frame. If `deadline` (a `Deadline`) runs out while the video is being
+        processed, raises TimeoutError.
+        """
+        self.stage_stats = None
+        video_info = sv.VideoInfo.from_video_path(source_video_path)
+        segment_frames = max(int(self.segment_seconds * video_info.fps), 1)
+        if self.workers > 1 and video_info.total_frames > segment_frames:
+            return self.process_video_parallel(classes, source_video_path, segment_frames, deadline)
+        return self.process_segment(classes, source_video_path, deadline=deadline)
+
+    def process_segment(self, classes, source_video_path, start=0, end=None, progress=True, deadline=None):
+        self.model.set_classes(classes)
+
+        frame_generator = sv.get_video_frames_generator(source_video_path, start=start, end=end)
         video_info = sv.VideoInfo.from_video_path(source_video_path)
         width, height = video_info.resolution_wh
         frame_area = width * height
+        total = (end if end is not None else video_info.total_frames) - start
+
+        if self.pipeline:
+            return self.run_pipeline(frame_generator, frame_area, total, progress, deadline)
+        detections_list = []
+        for frame in tqdm(frame_generator, total=total, desc="YOLO-World", disable=not progress):
+            check_deadline(deadline)
+            detections_list.append(self.detect(frame, frame_area))
+        return detections_list
+
+    def detect(self, frame, frame_area):
+        return self.postprocess(self.infer(frame), frame_area)
+
+    def infer(self, frame):
+        return infer_batch(self.model, [frame], self.confidence)[0]
+
+    def postprocess(self, detections, frame_area):
+        detections = detections.with_nms(threshold=self.nms_threshold)
+        return detections[(detections.area / frame_area) < 0.1]
 
+    def run_pipeline(self, frame_generator, frame_area, total=None, progress=True, deadline=None):
+        """
+        Same as calling `detect` on every frame, but with frames decoded by a background thread
+        (up to `prefetch` frames ahead), inference on the calling thread, and post-processing on
+        another thread (up to `post_queue` results behind). The fraction of the wall time each
+        stage was busy is stored in `stage_stats`.
+        """
+        frames = queue.Queue(maxsize=self.prefetch)
+        results = queue.Queue(maxsize=self.post_queue)
+        stop = threading.Event()
+        busy = {'decode': 0.0, 'infer': 0.0, 'postprocess': 0.0}
+        errors = []
         detections_list = []
-        for frame in tqdm(frame_generator, total=video_info.total_frames, desc="YOLO-World"):
-            results = self.model.infer(frame, confidence=self.confidence)
-            detections = sv.Detections.from_inference(results).with_nms(threshold=self.nms_threshold)
-            detections = detections[(detections.area / frame_area) < 0.1]
-            detections_list.append(detections)
+
+        def decode():
+            try:
+                frame_iterator = iter(frame_generator)
+                while True:
+                    t = time.perf_counter()
+                    frame = next(frame_iterator, _END)
+                    busy['decode'] += time.perf_counter() - t
+                    if not _put(frames, frame, stop) or frame is _END:
+                        return
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+
+        def postprocess():
+            try:
+                while (r := _get(results, stop)) is not _END:
+                    t = time.perf_counter()
+                    detections_list.append(self.postprocess(r, frame_area))
+                    busy['postprocess'] += time.perf_counter() - t
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+
+        decoder = threading.Thread(target=decode, daemon=True)
+        postprocessor = threading.Thread(target=postprocess, daemon=True)
+        start = time.perf_counter()
+        decoder.start()
+        postprocessor.start()
+        try:
+            with tqdm(total=total, desc="YOLO-World", disable=not progress) as bar:
+                while (frame := _get(frames, stop)) is not _END:
+                    check_deadline(deadline)
+                    t = time.perf_counter()
+                    r = self.infer(frame)
+                    busy['infer'] += time.perf_counter() - t
+                    if not _put(results, r, stop):
+                        break
+                    bar.update(1)
+            _put(results, _END, stop)
+            postprocessor.join()
+        finally:
+            stop.set()
+            decoder.join()
+            postprocessor.join()
+        if errors:
+            raise errors[0]
+
+        wall = time.perf_counter() - start
+        self.stage_stats = { stage: t / wall for stage, t in busy.items() } | { 'wall': wall, 'frames': len(detections_list) }
+        return detections_list
+
+    def search_video(self, classes, source_video_path, stride=30, precision_ms=None, deadline=None):
+        """
+        Coarse-to-fine alternative to `process_video` for `get_label_intervals`: detect every
+        `stride` frames and, only where the frame label (see `frame_label`) changes between two
+        samples, bisect until the frame where it changes (or until `precision_ms`). Labels are
+        assumed constant between equal samples, so presences shorter than `stride` may be missed.
+        Returns the label of every frame; the detector calls made are in `last_search_calls`.
+        Raises TimeoutError if `deadline` runs out.
+        The bisection seeks with `CAP_PROP_POS_FRAMES`, so the intervals only agree with the full
+        scan if seeking is frame-accurate (see `process_video_parallel`), which OpenCV doesn't
+        guarantee for every inter-frame codec (e.g. some H.264 streams).
+        """
+        self.model.set_classes(classes)
+
+        video_info = sv.VideoInfo.from_video_path(source_video_path)
+        width, height = video_info.resolution_wh
+        frame_area = width * height
+        total = video_info.total_frames
+        if total <= 0:
+            # some containers don't report their frame count, so there is nothing to bisect
+            labels = [frame_label(d) for d in self.process_video(classes, source_video_path, deadline)]
+            self.last_search_calls = len(labels)
+            return labels
+        precision = max(int((precision_ms or 0) / 1000 * video_info.fps), 1)
+
+        samples = {}
+        frame_generator = sv.get_video_frames_generator(source_video_path, stride=stride)
+        for i, frame in zip(range(0, total, stride), frame_generator):
+            check_deadline(deadline)
+            samples[i] = frame_label(self.detect(frame, frame_area))
+
+        video = cv2.VideoCapture(source_video_path)
+        def label(i):
+            if i not in samples:
+                check_deadline(deadline)
+                video.set(cv2.CAP_PROP_POS_FRAMES, i)
+                success, frame = video.read()
+                # past the end of the decodable frames (the frame count may be an estimate)
+                samples[i] = frame_label(self.detect(frame, frame_area)) if success else None
+            return samples[i]
+
+        labels = [None] * total
+        def refine(lo, hi):
+            if label(lo) == label(hi):
+                labels[lo:hi] = [label(lo)] * (hi - lo)
+            elif hi - lo <= precision:
+                mid = lo + max((hi - lo) // 2, 1)
+                labels[lo:mid] = [label(lo)] * (mid - lo)
+                labels[mid:hi] = [label(hi)] * (hi - mid)
+            else:
+                mid = (lo + hi) // 2
+                refine(lo, mid)
+                refine(mid, hi)
+
+        points = sorted(samples)
+        if points[-1] != total - 1: points.append(total - 1)
+        for lo, hi in tqdm(zip(points, points[1:]), total=len(points) - 1, desc="YOLO-World search"):
+            refine(lo, hi)
+        labels[-1] = label(total - 1)
+        video.release()
+
+        self.last_search_calls = len(samples)
+        return labels
+
+    def process_video_parallel(self, classes, source_video_path, segment_frames, deadline=None):
+        """
+        Long-video mode: split the video into segments of `segment_frames` frames and run
+        them on a pool of `workers` processes, each one with its own YOLO-World model.
+        The per-segment detections are concatenated in frame order, so the result (and the
+        intervals built from it by `get_object_intervals`) is the same as the serial scan as long
+        as seeking to each segment's start (`CAP_PROP_POS_FRAMES`) is frame-accurate. This was
+        checked with MJPG and MPEG-4 Part 2 (mp4v) sources; OpenCV doesn't guarantee it for every
+        inter-frame codec (e.g. some H.264 streams), where segment starts may be off by a few frames.
+        The workers' pipeline stats are combined into `stage_stats` (see `combine_stage_stats`).
+        """
+        pool = self.get_pool()
+        total_frames = sv.VideoInfo.from_video_path(source_video_path).total_frames
+        starts = list(range(0, total_frames, segment_frames))
+        # end=None reads up to CAP_PROP_FRAME_COUNT, the same limit as the serial scan
+        ends = starts[1:] + [None]
+        futures = [
+            pool.submit(_process_segment, classes, source_video_path, start, end, deadline)
+            for start, end in zip(starts, ends)
+        ]
+
+        start_time = time.perf_counter()
+        detections_list, segment_stats = [], []
+        try:
+            for future in tqdm(futures, desc="YOLO-World segments"):
+                detections, stats = future.result(timeout=deadline.timeout() if deadline is not None else None)
+                detections_list.extend(detections)
+                segment_stats.append(stats)
+        except FuturesTimeoutError:
+            raise TimeoutError("Deadline exceeded during object grounding")
+        finally:
+            # the segments still queued are dropped, the running ones stop at their own deadline check
+            for future in futures: future.cancel()
+        self.stage_stats = combine_stage_stats(segment_stats, time.perf_counter() - start_time)
         return detections_list
+
+    def get_pool(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=mp.get_context("spawn"), # CUDA can't be re-initialized in forked workers
+                initializer=_init_worker,
+                initargs=(self.model_id, self.confidence, self.nms_threshold, self.pipeline, self.prefetch, self.post_queue)
+            )
+        return self.pool
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
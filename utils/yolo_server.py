@@ -0,0 +1,259 @@
+from multiprocessing import shared_memory, resource_tracker
+from multiprocessing.managers import BaseManager
+from collections import deque
+from .yolo import infer_batch, check_deadline
+import supervision as sv
+from tqdm import tqdm
+import numpy as np
+import threading
+import queue
+import time
+import uuid
+import os
+
+DEFAULT_ADDRESS = "/tmp/yolo_world.sock"
+DEFAULT_AUTHKEY = b"yolo_world"
+EMBEDDINGS_CACHE_SIZE = 4096
+
+class _DetectorManager(BaseManager):
+    pass
+
+# client side registrations; the server overrides them with the actual queues
+_DetectorManager.register("requests")
+_DetectorManager.register("responses")
+_DetectorManager.register("release")
+
+class YOLOServer():
+    """
+    Local YOLO-World detection service. Loads the model once and serves frame batches sent
+    by `YOLOClient`s (possibly from different processes) through a Unix socket. The frames
+    themselves travel through shared memory, and the queued requests with the same classes and
+    confidence are run together in a single model call.
+    """
+    def __init__(self, model_id="yolo_world/l", address=DEFAULT_ADDRESS, authkey=DEFAULT_AUTHKEY, max_batch=32, batch_timeout=0.005, log=print):
+        from inference.models.yolo_world.yolo_world import YOLOWorld
+        self.model = YOLOWorld(model_id=model_id)
+        self.address = address
+        self.authkey = authkey
+        self.max_batch = max_batch
+        self.batch_timeout = batch_timeout
+        self.requests = queue.Queue()
+        self.responses = {}
+        self.lock = threading.Lock()
+        self.embeddings = {}
+        self.log = log
+
+    def _get_responses(self, client_id):
+        with self.lock:
+            if client_id not in self.responses:
+                self.responses[client_id] = queue.Queue()
+            return self.responses[client_id]
+
+    def _release_responses(self, client_id):
+        with self.lock:
+            self.responses.pop(client_id, None)
+
+    def respond(self, request, response):
+        # the responses of a client that already left (see `YOLOClient.close`) are dropped
+        with self.lock:
+            responses = self.responses.get(request["client"])
+        if responses is not None:
+            responses.put((request["id"], response))
+
+    def serve_forever(self):
+        _DetectorManager.register("requests", callable=lambda: self.requests)
+        _DetectorManager.register("responses", callable=self._get_responses)
+        _DetectorManager.register("release", callable=self._release_responses)
+        if os.path.exists(self.address): os.remove(self.address) # stale socket from a previous run
+        manager = _DetectorManager(address=self.address, authkey=self.authkey)
+        server = manager.get_server()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.log(f"YOLO-World server listening on {self.address}")
+
+        while True:
+            batch = [self.requests.get()]
+            n_frames = batch[0]["shape"][0]
+            deadline = time.time() + self.batch_timeout
+            while n_frames < self.max_batch:
+                try:
+                    request = self.requests.get(timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    break
+                batch.append(request)
+                n_frames += request["shape"][0]
+            self.process_batch(batch)
+
+    def process_batch(self, batch):
+        """
+        Run the frames of the batch through the model, one model call (of up to `max_batch` frames)
+        per group of requests with the same classes and confidence, so that the detections of a
+        request don't depend on the other requests queued with it. A request whose frames can't
+        be read (e.g. its client gave up and unlinked the block) fails alone.
+        """
+        groups = {}
+        try:
+            for request in batch:
+                try:
+                    shm = shared_memory.SharedMemory(name=request["shm"])
+                    # the client owns the block, keep the tracker from unlinking it on exit
+                    resource_tracker.unregister(shm._name, "shared_memory")
+                except Exception as e:
+                    self.respond(request, e)
+                    continue
+                groups.setdefault((tuple(request["classes"]), request["confidence"]), []).append((request, shm))
+            for (classes, confidence), requests in groups.items():
+                self.process_group(list(classes), confidence, requests)
+        finally:
+            for requests in groups.values():
+                for _, shm in requests:
+                    shm.close()
+
+    def process_group(self, classes, confidence, requests):
+        try:
+            frames = [
+                frame for request, shm in requests
+                for frame in np.ndarray(request["shape"], dtype=np.uint8, buffer=shm.buf)
+            ]
+            self.set_classes(classes)
+            detections = []
+            for i in range(0, len(frames), self.max_batch):
+                detections.extend(infer_batch(self.model, frames[i:i+self.max_batch], confidence))
+        except Exception as e:
+            # without the traceback, which would keep the frames (and so the blocks) referenced
+            for request, _ in requests:
+                self.respond(request, e.with_traceback(None))
+            return
+        offset = 0
+        for request, _ in requests:
+            n = request["shape"][0]
+            self.respond(request, detections[offset:offset+n])
+            offset += n
+
+    def set_classes(self, classes):
+        """
+        `YOLOWorld.set_classes` with the text embeddings cached per class, so that a new
+        combination of already seen classes doesn't go through the text encoder again.
+        """
+        import torch
+        world = self.model.model.model # ultralytics' WorldModel
+        missing = [c for c in classes if c not in self.embeddings]
+        if missing:
+            self.model.model.set_classes(missing)
+            for i, c in enumerate(missing):
+                self.embeddings[c] = world.txt_feats[:, i:i+1].clone()
+            while len(self.embeddings) > EMBEDDINGS_CACHE_SIZE:
+                self.embeddings.pop(next(iter(self.embeddings)))
+        world.txt_feats = torch.cat([self.embeddings[c] for c in classes], dim=1)
+        world.model[-1].nc = len(classes)
+        self.model.class_names = classes
+
+class YOLOClient():
+    """
+    Drop-in replacement of `YOLO` that sends the frames to a running `YOLOServer`.
+    Frame decoding and post-processing (NMS, area filtering) stay on the client side.
+    """
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=DEFAULT_AUTHKEY, confidence=0.01, nms_threshold=0.1, batch_size=16, in_flight=2, timeout=60):
+        self.manager = _DetectorManager(address=address, authkey=authkey)
+        self.manager.connect()
+        self.client_id = uuid.uuid4().hex
+        self.requests = self.manager.requests()
+        self.responses = self.manager.responses(self.client_id)
+        self.confidence = confidence
+        self.nms_threshold = nms_threshold
+        self.batch_size = batch_size
+        self.in_flight = in_flight
+        self.timeout = timeout # max wait (s) for the server to answer a batch
+
+    def close(self):
+        # the server drops this client's response queue
+        self.manager.release(self.client_id)
+
+    def warmup(self, classes=["person"]):
+        # a dummy frame, so the connection and the class embeddings are ready for the first video
+        pending = deque([self._submit([np.zeros((640, 640, 3), dtype=np.uint8)], classes)])
+        try:
+            self._collect(pending, {}, 640 * 640, tqdm(disable=True))
+        finally:
+            for _, shm in pending:
+                shm.close()
+                shm.unlink()
+
+    def process_video(self, classes, source_video_path, deadline=None):
+        frame_generator = sv.get_video_frames_generator(source_video_path)
+        video_info = sv.VideoInfo.from_video_path(source_video_path)
+        width, height = video_info.resolution_wh
+        frame_area = width * height
+
+        pending = deque()
+        results = {}
+        detections_list = []
+        progress = tqdm(total=video_info.total_frames, desc="YOLO-World (server)")
+        try:
+            batch = []
+            for frame in frame_generator:
+                check_deadline(deadline)
+                batch.append(frame)
+                if len(batch) == self.batch_size:
+                    pending.append(self._submit(batch, classes))
+                    batch = []
+                    if len(pending) >= self.in_flight:
+                        detections_list.extend(self._collect(pending, results, frame_area, progress, deadline))
+            if batch:
+                pending.append(self._submit(batch, classes))
+            while pending:
+                detections_list.extend(self._collect(pending, results, frame_area, progress, deadline))
+        finally:
+            progress.close()
+            for _, shm in pending:
+                shm.close()
+                shm.unlink()
+        return detections_list
+
+    def _submit(self, frames, classes):
+        shape = (len(frames), *frames[0].shape)
+        shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)))
+        np.stack(frames, out=np.ndarray(shape, dtype=np.uint8, buffer=shm.buf))
+        request_id = uuid.uuid4().hex
+        self.requests.put({
+            "client": self.client_id,
+            "id": request_id,
+            "shm": shm.name,
+            "shape": shape,
+            "classes": list(classes),
+            "confidence": self.confidence,
+        })
+        return request_id, shm
+
+    def _collect(self, pending, results, frame_area, progress, deadline=None):
+        request_id, shm = pending[0]
+        while request_id not in results:
+            timeout = deadline.timeout(self.timeout) if deadline is not None else self.timeout
+            try:
+                response_id, response = self.responses.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError(f"No response from the YOLO-World server in {timeout:.1f}s")
+            results[response_id] = response
+        pending.popleft()
+        shm.close()
+        shm.unlink()
+
+        response = results.pop(request_id)
+        if isinstance(response, Exception):
+            raise response
+        detections_list = []
+        for detections in response:
+            detections = detections.with_nms(threshold=self.nms_threshold)
+            detections_list.append(detections[(detections.area / frame_area) < 0.1])
+        progress.update(len(response))
+        return detections_list
+
+if __name__ == "__main__":
+    # python -m ViQAgent.utils.yolo_server
+    import argparse
+    parser = argparse.ArgumentParser(description="Shared YOLO-World detection server")
+    parser.add_argument("--model-id", default="yolo_world/l")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS)
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--batch-timeout", type=float, default=0.005)
+    args = parser.parse_args()
+    YOLOServer(args.model_id, args.address, max_batch=args.max_batch, batch_timeout=args.batch_timeout).serve_forever()